@@ -1,85 +1,181 @@
 import numpy as np
 
-
-def get_text_background_color(image, location):
+try:
+    from numba import njit, prange, get_num_threads
+except ImportError:  # numba为可选依赖（见requirements.txt），未安装时使用纯NumPy实现
+    njit = None
+
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _classify_and_median(region, bg_r, bg_g, bg_b, thr2, n_threads):
+        """
+        统计与背景颜色距离平方大于thr2的像素，并由各通道的256级直方图求中位数
+        :param region: uint8 RGB区域数组 (H, W, 3)
+        :param n_threads: 并行线程数，决定按行分块的数量
+        :return: (文字像素数量, 各通道中位数数组)
+        """
+        height, width = region.shape[0], region.shape[1]
+        n_chunks = max(1, min(height, n_threads))
+
+        # 每个线程按行分块，各自累加直方图，避免写冲突
+        chunk_hist = np.zeros((n_chunks, 3, 256), dtype=np.int64)
+        for t in prange(n_chunks):
+            for y in range(t * height // n_chunks, (t + 1) * height // n_chunks):
+                for x in range(width):
+                    r = np.int64(region[y, x, 0])
+                    g = np.int64(region[y, x, 1])
+                    b = np.int64(region[y, x, 2])
+                    dr = r - bg_r
+                    dg = g - bg_g
+                    db = b - bg_b
+                    if dr * dr + dg * dg + db * db > thr2:
+                        chunk_hist[t, 0, r] += 1
+                        chunk_hist[t, 1, g] += 1
+                        chunk_hist[t, 2, b] += 1
+
+        hist = np.zeros((3, 256), dtype=np.int64)
+        for t in range(n_chunks):
+            hist += chunk_hist[t]
+
+        count = 0
+        for v in range(256):
+            count += hist[0, v]
+
+        median = np.zeros(3, dtype=np.int64)
+        if count == 0:
+            return count, median
+
+        # 与np.median一致：样本数为偶数时取中间两个值的平均
+        lo_rank = (count - 1) // 2
+        hi_rank = count // 2
+        for c in range(3):
+            acc = 0
+            lo = -1
+            for v in range(256):
+                acc += hist[c, v]
+                if lo < 0 and acc > lo_rank:
+                    lo = v
+                if acc > hi_rank:
+                    median[c] = (lo + v) // 2
+                    break
+
+        return count, median
+else:
+    _classify_and_median = None
+
+
+def _histogram_median(pixels):
     """
-    检测文字区域的背景颜色
-    :param image: PIL Image对象
-    :param location: 文字位置信息 {left, top, width, height}
-    :return: RGB背景颜色元组
+    利用每个通道的256级直方图求uint8像素的中位数，避免排序
+    :param pixels: uint8像素数组 (N, 3)
+    :return: 各通道中位数数组
+    """
+    count = pixels.shape[0]
+    # 与np.median一致：样本数为偶数时取中间两个值的平均
+    ranks = np.array([(count - 1) // 2, count // 2])
+    median = np.empty(3, dtype=np.int64)
+    for c in range(3):
+        csum = np.bincount(pixels[:, c], minlength=256).cumsum()
+        lo, hi = np.searchsorted(csum, ranks, side='right')
+        median[c] = (lo + hi) // 2
+    return median
+
+
+def _dist2(color1, color2):
+    """计算两个颜色之间欧氏距离的平方（只用于与阈值的平方比较，省去开方）"""
+    dr = color1[0] - color2[0]
+    dg = color1[1] - color2[1]
+    db = color1[2] - color2[2]
+    return dr * dr + dg * dg + db * db
+
+
+def _sample_background(img_array, location, img_w, img_h):
+    """在文字区域边缘采样背景像素，返回采样点RGB数组 (N, 3)，区域无效时返回None"""
+    left = int(location['left'])
+    top = int(location['top'])
+    width = int(location['width'])
+    height = int(location['height'])
+
+    # 确保坐标在图像范围内
+    left = max(0, left)
+    top = max(0, top)
+    right = min(img_w, left + width)
+    bottom = min(img_h, top + height)
+
+    if right <= left or bottom <= top:
+        return None
+
+    # 先截取区域（右、下各多留1像素给边缘采样点），之后只在区域内用局部坐标处理
+    region = img_array[top:min(img_h, bottom + 1), left:min(img_w, right + 1), :3]
+
+    if region.size == 0:
+        return None
+
+    # 采样边缘像素（通常背景在文字周围），坐标相对于区域左上角
+    sample_margin = 0
+    sample_points = np.array([
+        # 上边缘
+        (sample_margin, sample_margin),
+        (width // 2, sample_margin),
+        (width - sample_margin, sample_margin),
+        # 下边缘
+        (sample_margin, height - sample_margin),
+        (width // 2, height - sample_margin),
+        (width - sample_margin, height - sample_margin),
+        # 左边缘
+        (sample_margin, height // 2),
+        # 右边缘
+        (width - sample_margin, height // 2)
+    ], dtype=np.int64)
+    xs, ys = sample_points[:, 0], sample_points[:, 1]
+
+    # 只保留区域范围内的采样点，一次索引取出所有采样点的RGB通道
+    valid = (xs < region.shape[1]) & (ys < region.shape[0])
+    if not valid.any():
+        return None
+    return region[ys[valid], xs[valid]]
+
+
+def detect_colors(img_array, location, img_w, img_h, text_location=None, color_threshold=100):
+    """
+    同时检测文字区域的背景颜色和文字颜色
+    :param img_array: 图片的numpy数组 (H, W, C)，由调用方对整张图片转换一次后共享
+    :param location: 文字位置信息 {left, top, width, height}，用于检测背景颜色
+    :param img_w: 图片宽度
+    :param img_h: 图片高度
+    :param text_location: 用于检测文字颜色的位置信息，默认与location相同
+    :param color_threshold: 颜色差异阈值，值越大越容易区分文字和背景
+    :return: (RGB背景颜色元组, RGB文字颜色元组)
     """
     try:
-        # 转换为numpy数组以便处理
-        img_array = np.array(image)
-
-        left = int(location['left'])
-        top = int(location['top'])
-        width = int(location['width'])
-        height = int(location['height'])
-
-        # 确保坐标在图像范围内
-        left = max(0, left)
-        top = max(0, top)
-        right = min(image.width, left + width)
-        bottom = min(image.height, top + height)
-
-        if right <= left or bottom <= top:
-            return (255, 255, 255)  # 默认白色
-
-        # 获取文字区域
-        text_region = img_array[top:bottom, left:right]
-
-        if text_region.size == 0:
-            return (255, 255, 255)  # 默认白色
-
-        # 采样边缘像素（通常背景在文字周围）
-        background_samples = []
-
-        # 采样边缘像素
-        sample_margin = 0
-        sample_points = [
-            # 上边缘
-            (left + sample_margin, top + sample_margin),
-            (left + width // 2, top + sample_margin),
-            (left + width - sample_margin, top + sample_margin),
-            # 下边缘
-            (left + sample_margin, top + height - sample_margin),
-            (left + width // 2, top + height - sample_margin),
-            (left + width - sample_margin, top + height - sample_margin),
-            # 左边缘
-            (left + sample_margin, top + height // 2),
-            # 右边缘
-            (left + width - sample_margin, top + height // 2)
-        ]
-
-        for x, y in sample_points:
-            pixel = img_array[y, x]
-            background_samples.append(tuple(pixel[:3]))  # 取RGB通道
+        background_samples = _sample_background(img_array, location, img_w, img_h)
+    except Exception as e:
+        print(f"背景颜色检测错误: {str(e)}")
+        background_samples = None
 
+    if background_samples is None:
+        bg_color = (255, 255, 255)  # 默认白色
+    else:
         # 取所有采样点的中位数
-        background_samples = np.array(background_samples)
-        median_color = np.median(background_samples, axis=0)
-
-        return tuple(int(c) for c in median_color)
+        bg_color = tuple(int(c) for c in np.median(background_samples, axis=0))
 
-    except Exception as e:
-        print(f"背景颜色检测错误: {str(e)}")
-        return (255, 255, 255)  # 默认白色
+    text_color = get_text_color(img_array, text_location or location, img_w, img_h, bg_color, color_threshold)
+    return bg_color, text_color
 
 
-def get_text_color(image, location, bg_color=None, color_threshold=100):
+def get_text_color(img_array, location, img_w, img_h, bg_color, color_threshold=100):
     """
     检测文字颜色（基于背景颜色对比）
-    :param image: PIL Image对象
+    :param img_array: 图片的numpy数组 (H, W, C)，由调用方对整张图片转换一次后共享
     :param location: 文字位置信息 {left, top, width, height}
-    :param bg_color: 已知的背景颜色RGB元组
+    :param img_w: 图片宽度
+    :param img_h: 图片高度
+    :param bg_color: 背景颜色RGB元组（由detect_colors检测）
     :param color_threshold: 颜色差异阈值，值越大越容易区分文字和背景
     :return: RGB文字颜色元组
     """
     try:
-        # 转换为numpy数组以便处理
-        img_array = np.array(image)
-
         left = int(location['left'])
         top = int(location['top'])
         width = int(location['width'])
@@ -88,50 +184,47 @@ def get_text_color(image, location, bg_color=None, color_threshold=100):
         # 确保坐标在图像范围内
         left = max(0, left)
         top = max(0, top)
-        right = min(image.width, left + width)
-        bottom = min(image.height, top + height)
+        right = min(img_w, left + width)
+        bottom = min(img_h, top + height)
 
         if right <= left or bottom <= top:
             return (0, 0, 0)  # 默认黑色
 
-        # 获取文字区域
-        text_region = img_array[top:bottom, left:right]
+        # 获取文字区域（仅RGB通道），之后只在该区域内处理
+        rgb_region = img_array[top:bottom, left:right, :3]
 
-        if text_region.size == 0:
+        if rgb_region.size == 0:
             return (0, 0, 0)  # 默认黑色
 
-        # 如果没有提供背景颜色，使用简单方法检测
-        if bg_color is None:
-            bg_color = get_text_background_color(image, location)
-
-        # 计算颜色差异函数
-        def color_distance(color1, color2):
-            """计算两个颜色之间的欧氏距离"""
-            diff = np.array(color1, dtype=np.int32) - np.array(color2, dtype=np.int32)
-            return np.sqrt(np.sum(diff ** 2))
-
-        # 收集与背景颜色明显不同的像素
-        text_pixels = []
-
-        # 遍历整个文字区域
-        for y in range(text_region.shape[0]):
-            for x in range(text_region.shape[1]):
-                pixel_color = tuple(text_region[y, x][:3])
-                # 如果像素颜色与背景颜色差异足够大，认为是文字像素
-                if color_distance(pixel_color, bg_color) > color_threshold:
-                    text_pixels.append(pixel_color)
-
-        # 如果没有找到明显不同的像素，使用备选方案
-        if not text_pixels:
-            return get_text_color_fallback(text_region, bg_color)
-
-        # 使用中位数作为文字颜色
-        text_pixels_array = np.array(text_pixels)
-        median_color = np.median(text_pixels_array, axis=0)
+        if _classify_and_median is not None:
+            # numba内核一次遍历完成分类和中位数计算
+            count, median_color = _classify_and_median(
+                rgb_region, int(bg_color[0]), int(bg_color[1]), int(bg_color[2]),
+                color_threshold ** 2, get_num_threads()
+            )
+
+            # 如果没有找到明显不同的像素，使用备选方案
+            if count == 0:
+                return get_text_color_fallback(rgb_region, bg_color)
+        else:
+            # 一次性计算整个区域每个像素与背景颜色的距离平方（int32避免uint8溢出）
+            diff = rgb_region.astype(np.int32) - np.asarray(bg_color[:3], dtype=np.int32)
+            dist2 = np.einsum('hwc,hwc->hw', diff, diff)
+
+            # 与背景颜色差异足够大的像素认为是文字像素
+            text_pixels = rgb_region[dist2 > color_threshold ** 2]
+
+            # 如果没有找到明显不同的像素，使用备选方案
+            if text_pixels.size == 0:
+                return get_text_color_fallback(rgb_region, bg_color)
+
+            # 使用中位数作为文字颜色
+            median_color = _histogram_median(text_pixels)
+
         text_color = tuple(map(int, median_color))
 
         # 最终验证
-        if color_distance(text_color, bg_color) < color_threshold:  # 如果颜色太接近背景
+        if _dist2(text_color, bg_color) < color_threshold * color_threshold:  # 如果颜色太接近背景
             return get_contrasting_color(bg_color)  # 使用对比色
         return text_color
 
@@ -142,15 +235,12 @@ def get_text_color(image, location, bg_color=None, color_threshold=100):
 
 def get_text_color_fallback(text_region, bg_color):
     """备用的文字颜色检测方法"""
-    # 方法1: 使用整个区域的中位数，但与背景不同
+    # 方法1: 使用整个区域的中位数（直方图计算，无需排序），但与背景不同
     pixels = text_region.reshape(-1, 3)
-    median_color = tuple(map(int, np.median(pixels, axis=0)))
+    median_color = tuple(map(int, _histogram_median(pixels)))
 
     # 检查与背景的差异
-    def color_distance(color1, color2):
-        return np.sqrt(sum((c1 - c2) ** 2 for c1, c2 in zip(color1, color2)))
-
-    if color_distance(median_color, bg_color) > 20:
+    if _dist2(median_color, bg_color) > 20 * 20:
         return median_color
 
     # 方法2: 使用与背景对比的颜色
@@ -159,12 +249,6 @@ def get_text_color_fallback(text_region, bg_color):
 
 def get_contrasting_color(bg_color):
     """根据背景颜色返回一个对比色"""
-    # 计算背景亮度
-    brightness = (bg_color[0] * 299 + bg_color[1] * 587 + bg_color[2] * 114) / 1000
-
-    # 如果背景较亮，返回暗色；如果背景较暗，返回亮色
-    if brightness > 128:
-        return (0, 0, 0)  # 黑色
-    else:
-        return (255, 255, 255)  # 白色
+    # 背景亮度（放大1000倍用整数比较，亮度 > 128）较亮时返回黑色，较暗时返回白色
+    return (0, 0, 0) if (bg_color[0] * 299 + bg_color[1] * 587 + bg_color[2] * 114) > 128_000 else (255, 255, 255)
 
@@ -1,6 +1,9 @@
 # -*- coding: gbk -*-
 from PIL import Image, ImageDraw, ImageFont  # ͼƬ滻
 from pathlib import Path
+from bisect import bisect_left, insort
+from functools import lru_cache
+import numpy as np
 import color_process
 
 
@@ -17,26 +20,33 @@ def merge_text_lines(ocr_results, max_line_gap=1, max_x_diff=0.1):
     # 
     sorted_results = sorted(ocr_results, key=lambda x: (x['location']['top'], x['location']['left']))
     paragraphs = []
+    # ĩϢĩеױ(last_bottom, , last_left, last_mid)
+    last_lines = []
 
     for res in sorted_results:
         loc = res['location']
         top, left, height, width = loc['top'], loc['left'], loc['height'], loc['width']
-
-        flag = True
-        for para in paragraphs:
-            if not para:
-                continue
-            last_bottom = para['res'][-1]['location']['top'] + para['res'][-1]['location']['height']
-            last_left = para['res'][-1]['location']['left']
-            last_mid = (last_left * 2 + para['res'][-1]['location']['width']) / 2
-            mid = (left * 2 + width) / 2
-            if top > last_bottom and (top - last_bottom) <= height * max_line_gap and (abs(left - last_left) <= max_x_diff * width or abs(mid - last_mid) <= max_x_diff * width):
-                para['res'].append(res)
-                flag = False
-                break
-
-        if flag:
+        mid = (left * 2 + width) / 2
+
+        # ֻĩеױ [top - height * max_line_gap, top) ڵĶſνӵǰ
+        lo = bisect_left(last_lines, (top - height * max_line_gap,))
+        hi = bisect_left(last_lines, (top,))
+
+        # ںѡѡˮƽλӽһ
+        best = None
+        for pos in range(lo, hi):
+            _, _, last_left, last_mid = last_lines[pos]
+            if abs(left - last_left) <= max_x_diff * width or abs(mid - last_mid) <= max_x_diff * width:
+                if best is None or abs(mid - last_mid) < abs(mid - last_lines[best][3]):
+                    best = pos
+
+        if best is None:
+            index = len(paragraphs)
             paragraphs.append({'res': [res]})
+        else:
+            index = last_lines.pop(best)[1]
+            paragraphs[index]['res'].append(res)
+        insort(last_lines, (top + height, index, left, mid))
 
     for para in paragraphs:
         words = ""
@@ -44,15 +54,45 @@ def merge_text_lines(ocr_results, max_line_gap=1, max_x_diff=0.1):
             words += res['words'] + '\n'
         para['words'] = words
 
+        # ߽磺еλ(N, 4)һιԼڶ
+        boxes = np.array([[r['location'][k] for k in ('left', 'top', 'width', 'height')] for r in para['res']], dtype=np.int32)
+        left, top = boxes[:, :2].min(axis=0)
+        right, bottom = (boxes[:, :2] + boxes[:, 2:]).max(axis=0)
+        para['location'] = {
+            'left': int(left),
+            'top': int(top),
+            'width': int(right - left),
+            'height': int(bottom - top)
+        }
+
     return paragraphs
 
 
+def get_output_suffix(image_path):
+    # ͼƬԭͼʽPIL޷дĸʽPSDչʱPNG
+    # :param image_path: ԭʼͼƬ·
+    # :return: ͼƬչ
+    suffix = Path(image_path).suffix.lower()
+    if Image.registered_extensions().get(suffix) in Image.SAVE:
+        return suffix
+    return ".png"
+
+
+@lru_cache(maxsize=64)
+def _get_font(path, size):
+    # (·, ֺ)truetype壬ÿ½ļ
+    return ImageFont.truetype(path, size)
+
+
 def replace_text_in_image(original_path, output_path, paragraphs, translations):
     # ͼƬ滻
     try:
         # ԭʼͼƬ
         img = Image.open(original_path)
-        draw = ImageDraw.Draw(img)
+        # ɫⰴRGBͨҶ/ɫͼƬת͸ȵתΪRGBAԱ͸ͨ
+        if img.mode not in ("RGB", "RGBA"):
+            has_alpha = "A" in img.getbands() or "transparency" in img.info
+            img = img.convert("RGBA" if has_alpha else "RGB")
 
         # Լ壬ʧʹĬ
         try:
@@ -63,57 +103,66 @@ def replace_text_in_image(original_path, output_path, paragraphs, translations):
                 "/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf"  # Linux
             ]
 
-            font = None
+            # ֻѭȷһ·
+            font_path = None
             for path in font_paths:
                 if Path(path).exists():
-                    font = ImageFont.truetype(path, 20)  # ʼС
+                    font = _get_font(path, 20)  # ʼС
+                    font_path = path
                     break
 
-            if font is None:
+            if font_path is None:
                 font = ImageFont.load_default()
         except:
+            font_path = None
             font = ImageFont.load_default()
 
-        # ÿ
-        for i, para1 in enumerate(paragraphs):
+        # ͼƬֻתһnumpy飨дȹжɫ⹲ڻƱ
+        # ɫԭʼͼƬ⣬ƵıӰ
+        img_array = np.array(img)
+        img_w, img_h = img.width, img.height
+
+        # ÿλúɫ
+        blocks = []
+        for para1 in paragraphs:
             para = para1['res']
-            # ı߽
-            left = min(r['location']['left'] for r in para)
-            top = min(r['location']['top'] for r in para)
-            right = max(r['location']['left'] + r['location']['width'] for r in para)
-            bottom = max(r['location']['top'] + r['location']['height'] for r in para)
-            width = right - left
-            height = bottom - top
-
-            # ϲλϢ
-            merged_location = {
-                'left': left,
-                'top': top,
-                'width': width,
-                'height': height
-            }
-
-            # ıɫ
-            bg_color = color_process.get_text_background_color(img, merged_location)
-            # bg_color = "white"
-            # ɫʹõһֿɫΪο
-            text_color = color_process.get_text_color(img, para[0]['location'], bg_color)
-            # text_color = "black"
-
-            # Ʊԭʼı
-            draw.rectangle(
-                [(left, top), (right, bottom)],
-                fill=bg_color
+            # ϲĶλϢmerge_text_linesѼ㣩
+            merged_location = para1['location']
+
+            # ıɫɫʹõһֿɫΪο
+            bg_color, text_color = color_process.detect_colors(
+                img_array, merged_location, img_w, img_h, text_location=para[0]['location']
             )
 
-            # Ʒı
+            blocks.append((merged_location, bg_color, text_color))
+
+        # Ƭбԭʼıdraw.rectangleһҡ±߽磩
+        for merged_location, bg_color, _ in blocks:
+            left, top = max(0, merged_location['left']), max(0, merged_location['top'])
+            # draw.rectangleһüͼƬڣ⸺±ƻͼƬһ
+            right = max(-1, merged_location['left'] + merged_location['width'])
+            bottom = max(-1, merged_location['top'] + merged_location['height'])
+            # RGBAͼƬıͬ͸
+            img_array[top:bottom + 1, left:right + 1] = tuple(bg_color) + (255,) * (img_array.shape[2] - 3)
+
+        # fromarrayɵͼƬԭͼԪݣICCļEXIFDPIȣԭͼinfo
+        info = img.info
+        img = Image.fromarray(img_array)
+        img.info = dict(info)
+        draw = ImageDraw.Draw(img)
+
+        # ÿ䷭ıFreeTypeȾPILɣ
+        for i, para1 in enumerate(paragraphs):
+            para = para1['res']
+            merged_location, _, text_color = blocks[i]
+
             text = translations[i]
             font_size = para[0]['location']['height']
 
             # С
-            if hasattr(font, "path"):  # truetype
+            if font_path is not None:  # truetype
                 try:
-                    font = ImageFont.truetype(font.path, font_size)
+                    font = _get_font(font_path, font_size)
                 except:
                     pass
 
@@ -126,8 +175,12 @@ def replace_text_in_image(original_path, output_path, paragraphs, translations):
 
             draw.text((x, y), text, fill=text_color, font=font)
 
-        # 
-        img.save(output_path)
+        # ʽдԭͼICCļԪݣɫʾ仯
+        save_params = {key: info[key] for key in ("icc_profile", "exif", "dpi") if key in info}
+        # JPEGʹøҲɫȳ»ֵıԵ
+        if Image.registered_extensions().get(Path(output_path).suffix.lower()) == "JPEG":
+            save_params.update(quality=95, subsampling=0, optimize=True)
+        img.save(output_path, **save_params)
         return True
     except Exception as e:
         print(f"ͼƬ: {str(e)}")
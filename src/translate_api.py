@@ -3,13 +3,21 @@ import sys
 import time
 import base64
 import json
+import re
 import requests
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
 from pathlib import Path
 from dotenv import dotenv_values
 import text_process
 import concurrent.futures
 import threading
 
+# 进程内共享的HTTP会话，复用keep-alive连接，避免每次请求重新握手
+# 连接池大小覆盖并行翻译的线程数，线程间可安全共享
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+
 
 def get_project_root():
     """获取项目根目录"""
@@ -71,17 +79,20 @@ def load_config():
 def get_baidu_ocr_token(api_key, secret_key):
     """获取百度OCR的访问令牌"""
     url = f"https://aip.baidubce.com/oauth/2.0/token?grant_type=client_credentials&client_id={api_key}&client_secret={secret_key}"
-    response = requests.post(url)
+    response = _SESSION.post(url)
     return response.json().get("access_token")
 
 
 def baidu_ocr_with_location(image_path, access_token):
     """获取带位置信息的OCR结果"""
     try:
+        # 保持bytes类型直接作为表单值提交，省去对base64结果整体decode成str的一次复制
         with open(image_path, "rb") as f:
-            img_base64 = base64.b64encode(f.read()).decode()
+            img_base64 = base64.b64encode(f.read())
 
         # 使用高精度接口获取位置信息
+        # 该接口只接受x-www-form-urlencoded表单中的base64图片（或公网图片url），
+        # 不支持multipart文件上传，因此无法省去base64编码
         url = f"https://aip.baidubce.com/rest/2.0/ocr/v1/accurate?access_token={access_token}"
         headers = {"Content-Type": "application/x-www-form-urlencoded"}
         # 优化参数：启用段落检测和方向检测
@@ -92,7 +103,7 @@ def baidu_ocr_with_location(image_path, access_token):
             # "detect_direction": "true",  # 检测文本方向
             # "vertexes_location": "true"  # 获取更精确的顶点位置
         }
-        response = requests.post(url, headers=headers, data=data)
+        response = _SESSION.post(url, headers=headers, data=data)
         result = response.json()
 
         if "words_result" not in result:
@@ -106,15 +117,36 @@ def baidu_ocr_with_location(image_path, access_token):
         raise Exception(f"OCR处理错误: {str(e)}")
 
 
+def deepseek_chat(prompt, api_key, max_tokens=4000, timeout=60):
+    """向DeepSeek API发送单轮对话请求，返回(模型回复内容, finish_reason)；finish_reason为"length"表示回复被max_tokens截断"""
+    url = "https://api.deepseek.com/v1/chat/completions"
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+    payload = {
+        "model": "deepseek-chat",
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": 0.1,
+        "max_tokens": max_tokens
+    }
+
+    response = _SESSION.post(url, headers=headers, json=payload, timeout=timeout)
+    result = response.json()
+
+    if "choices" in result:
+        choice = result["choices"][0]
+        return choice["message"]["content"].strip(), choice.get("finish_reason")
+    else:
+        error_msg = result.get("error", {}).get("message", "未知错误")
+        error_code = result.get("error", {}).get("code", "未知")
+        raise Exception(f"翻译失败 [{error_code}]: {error_msg}")
+
+
 def deepseek_translate(text, api_key, target_lang="中文"):
     """使用DeepSeek API进行文本翻译"""
     try:
-        url = "https://api.deepseek.com/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-
         prompt = (
             f"请将以下内容准确翻译成{target_lang}，严格保持原始格式：\n\n"
             f"文本内容：\n\n{text}\n\n"
@@ -123,49 +155,92 @@ def deepseek_translate(text, api_key, target_lang="中文"):
             "2. 保留所有换行符、空格和标点\n"
         )
 
-        payload = {
-            "model": "deepseek-chat",
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.1,
-            "max_tokens": 4000
-        }
-
-        response = requests.post(url, headers=headers, json=payload, timeout=60)
-        result = response.json()
-
-        if "choices" in result:
-            return result["choices"][0]["message"]["content"].strip()
-        else:
-            error_msg = result.get("error", {}).get("message", "未知错误")
-            error_code = result.get("error", {}).get("code", "未知")
-            raise Exception(f"翻译失败 [{error_code}]: {error_msg}")
+        content, _ = deepseek_chat(prompt, api_key)
+        return content
     except requests.exceptions.Timeout:
         raise Exception("翻译请求超时，请重试")
     except Exception as e:
         raise Exception(f"翻译处理错误: {str(e)}")
 
 
+@lru_cache(maxsize=256)
+def cached_translate(text, api_key, target_lang):
+    """带缓存的文本翻译，重复出现的文本（页码、页眉页脚等）只请求一次；失败的请求不会被缓存"""
+    return deepseek_translate(text, api_key, target_lang)
+
+
+def unique_texts(paragraphs):
+    """按出现顺序返回去重后的非空段落文本"""
+    return list(dict.fromkeys(para['words'] for para in paragraphs if para['words'].strip()))
+
+
 def parallel_translate(paragraphs, api_key, target_lang, max_workers=3):
-    """并行翻译多个段落（保持原始顺序）"""
+    """并行翻译多个段落（保持原始顺序），空段落不发请求，相同文本只翻译一次"""
 
-    def translate_single(para):
+    def translate_single(text):
         """单个段落的翻译任务"""
         try:
-            result = deepseek_translate(para['words'], api_key, target_lang)
+            result = cached_translate(text, api_key, target_lang)
             return result
         except Exception as e:
             error_msg = f"翻译失败: {str(e)}"
             return error_msg
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # 方法1: 使用map（最简单，保持顺序）
-        translations = list(executor.map(
-            lambda para: translate_single(para),
-            paragraphs
-        ))
+    texts = unique_texts(paragraphs)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        # 使用map保持顺序
+        translated = dict(zip(texts, executor.map(translate_single, texts)))
+    return [translated.get(para['words'], "") for para in paragraphs]
+
+
+def split_batch_translation(content, count):
+    """按<<<序号>>>分隔符拆分批量翻译结果，序号与段落数不一致或有段落译文为空时返回None"""
+    parts = re.split(r"<<<(\d+)>>>", content)
+    indices = [int(n) for n in parts[1::2]]
+    if indices != list(range(1, count + 1)):
+        return None
+    translations = [text.strip() for text in parts[2::2]]
+    # 待翻译的段落都非空，译文为空说明回复不完整
+    if not all(translations):
+        return None
     return translations
 
 
+def batch_translate(paragraphs, api_key, target_lang, max_workers=3):
+    """将所有段落合并为一次请求翻译（保持原始顺序），解析失败时退回逐段并行翻译"""
+    # 空段落不翻译，相同文本只在请求中出现一次
+    texts = unique_texts(paragraphs)
+    if not texts:
+        return [""] * len(paragraphs)
+
+    try:
+        segments = "\n".join(f"<<<{i}>>>\n{text}" for i, text in enumerate(texts, 1))
+        prompt = (
+            f"请将以下{len(texts)}段内容分别准确翻译成{target_lang}，严格保持原始格式：\n\n"
+            f"每段以<<<序号>>>开头：\n\n{segments}\n\n"
+            "翻译要求：\n"
+            "1. 按原顺序逐段返回，每段前保留对应的<<<序号>>>，不要合并或拆分段落\n"
+            "2. 仅返回翻译结果，不要添加任何额外说明（包括引导句）\n"
+            "3. 保留所有换行符、空格和标点\n"
+        )
+
+        content, finish_reason = deepseek_chat(prompt, api_key, max_tokens=8192, timeout=180)
+        # 回复被max_tokens截断时，最后一段可能只翻译了一半
+        if finish_reason == "length":
+            print("批量翻译结果超出长度限制被截断，改为逐段翻译")
+        else:
+            translations = split_batch_translation(content, len(texts))
+            if translations is not None:
+                translated = dict(zip(texts, translations))
+                return [translated.get(para['words'], "") for para in paragraphs]
+            print("批量翻译结果不完整（段落数不一致或有译文为空），改为逐段翻译")
+    except Exception as e:
+        print(f"批量翻译失败: {str(e)}，改为逐段翻译")
+
+    return parallel_translate(paragraphs, api_key, target_lang, max_workers)
+
+
 def main():
 
     try:
@@ -204,7 +279,7 @@ def main():
         # 并行线程数
         max_workers = min(5, len(original_paragraphs))
 
-        translations = parallel_translate(
+        translations = batch_translate(
             original_paragraphs,
             config["DEEPSEEK_API_KEY"],
             target_lang,
@@ -223,7 +298,9 @@ def main():
 
         # 图片文字替换
         print("\n正在替换图片文字...")
-        output_path = "./result/" + Path(image_path).stem + "_translated.jpg"
+        # 保留原图格式，避免PNG等无损图片被重新编码为JPEG
+        output_suffix = text_process.get_output_suffix(image_path)
+        output_path = "./result/" + Path(image_path).stem + "_translated" + output_suffix
         success = text_process.replace_text_in_image(image_path, output_path, original_paragraphs, translations)
 
         if success: